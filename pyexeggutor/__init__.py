@@ -1,82 +1,139 @@
 #!/usr/bin/env python
 import sys
 import os
+import io
 import time
 import gzip
 import bz2
 import subprocess
 import pickle
+import struct
 import json
 import logging
 import functools
+import math
 import hashlib
+import mmap
 import shutil
+import shlex
 import tarfile
+import tempfile
+import tracemalloc
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import TextIO
 import pathlib
 from tqdm import tqdm
-from memory_profiler import memory_usage
 
-__version__ = "2025.1.23"
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# Faster drop-in decompressors (falls back to stdlib gzip/bz2)
+try:
+    from isal import igzip as gzip_reader_module
+except ImportError:
+    gzip_reader_module = gzip
+
+try:
+    import indexed_bzip2
+except ImportError:
+    indexed_bzip2 = None
+
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Peak memory of `RunShellCommand` commands (Unix only)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Minimum compressed file size for `open_file_reader` to decode with multiple threads 
+# (rapidgzip with `parallel=True` or indexed_bzip2). Thread startup costs more than it saves on smaller files.
+PARALLEL_DECOMPRESSION_MINIMUM_FILESIZE = 64 * 1024**2
+
+__version__ = "2026.10.14"
 
 # Read/Write
 # ==========
+# Compression types inferred from file extensions when `compression="auto"`
+COMPRESSION_BY_EXTENSION = {"gz":"gzip", "bz2":"bz2"}
+
 # Get file object
-def open_file_reader(filepath: str, compression="auto", binary=False):
+def open_file_reader(filepath: str, compression="auto", binary=False, buffer_size=131072, parallel=False):
     """
     Opens a file for reading with optional compression.
 
     Args:
         filepath (str): Path to the file.
         compression (str, optional): Type of compression {None, 'gzip', 'bz2'}. Defaults to "auto".
+            Uses `isal` (gzip) for decompression if installed and `indexed_bzip2` (bz2) for files larger
+            than `PARALLEL_DECOMPRESSION_MINIMUM_FILESIZE` if installed.
         binary (bool, optional): Whether to open the file in binary mode. Defaults to False.
+        buffer_size (int, optional): Size of the read buffer in bytes. Defaults to 131072 (128KB).
+        parallel (bool, optional): Whether to decompress gzip files larger than `PARALLEL_DECOMPRESSION_MINIMUM_FILESIZE`
+            with multiple threads using `rapidgzip` (if installed). Defaults to False.
 
     Returns:
         file object: A file-like object.
     """
     # Determine compression type based on the file extension if 'auto' is specified
     if compression == "auto":
-        ext = filepath.split(".")[-1].lower()
-        if ext == "gz":
-            compression = "gzip"
-        elif ext == "bz2":
-            compression = "bz2"
-        else:
-            compression = None
+        compression = COMPRESSION_BY_EXTENSION.get(filepath.rpartition(".")[2].lower())
 
     # Determine the mode based on the 'binary' flag
     mode = "rb" if binary else "rt"
 
     # Open the file with or without compression
     if not compression:
-        return open(filepath, mode)
+        return open(filepath, mode, buffering=buffer_size)
     elif compression == "gzip":
-        return gzip.open(filepath, mode)
+        if parallel and (rapidgzip is not None) and (os.path.getsize(filepath) >= PARALLEL_DECOMPRESSION_MINIMUM_FILESIZE):
+            stream = rapidgzip.open(filepath, parallelization=os.cpu_count() or 1)
+        else:
+            stream = gzip_reader_module.open(filepath, "rb")
     elif compression == "bz2":
-        return bz2.open(filepath, mode)
+        if (indexed_bzip2 is not None) and (os.path.getsize(filepath) >= PARALLEL_DECOMPRESSION_MINIMUM_FILESIZE):
+            stream = indexed_bzip2.open(filepath, parallelization=os.cpu_count() or 1)
+        else:
+            stream = bz2.open(filepath, "rb")
     else:
         raise ValueError(f"Unsupported compression type: {compression}")
+
+    # Decompress in large blocks instead of the small default chunks
+    stream = io.BufferedReader(stream, buffer_size)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream)
             
 # Get file object
-def open_file_writer(filepath: str, compression="auto", binary=False):
+def open_file_writer(filepath: str, compression="auto", binary=False, buffer_size=131072):
     """
     Args:
         filepath (str): path/to/file
         compression (str, optional): {None, gzip, bz2}. Defaults to "auto".
         binary (bool, optional): Whether to open the file in binary mode. Defaults to False.
+        buffer_size (int, optional): Size of the write buffer in bytes. Defaults to 131072 (128KB).
     
     Returns:
         file object
     """
     if compression == "auto":
-        ext = filepath.split(".")[-1].lower()
-        if ext == "gz":
-            compression = "gzip"
-        elif ext == "bz2":
-            compression = "bz2"
-        else:
-            compression = None
+        compression = COMPRESSION_BY_EXTENSION.get(filepath.rpartition(".")[2].lower())
 
     if binary:
         mode = "wb"
@@ -84,14 +141,20 @@ def open_file_writer(filepath: str, compression="auto", binary=False):
         mode = "wt"
 
     if not compression:
-        return open(filepath, mode)
+        return open(filepath, mode, buffering=buffer_size)
     elif compression == "gzip":
-        return gzip.open(filepath, mode)
+        stream = gzip.open(filepath, "wb")
     elif compression == "bz2":
-        return bz2.open(filepath, mode)
+        stream = bz2.open(filepath, "wb")
     else:
         raise ValueError(f"Unsupported compression type: {compression}")
 
+    # Batch small writes into large blocks before they reach the compressor
+    stream = io.BufferedWriter(stream, buffer_size)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream)
+
 def gzip_file(source_filepath: str, destination_filepath: str, logger=None):
     """
     Compress a source file using gzip and write it to a destination file.
@@ -199,22 +262,91 @@ def copy_file(source_filepath, destination_filepath, gzip=False, logger=None):
         raise IOError(msg)
 
 # Pickle I/O
+# Out-of-band layout: [magic][number of buffers][buffer size, buffer]...[pickle stream] with counts/sizes as little-endian uint64.
+# The magic starts with a byte that is not a pickle opcode so it can't be confused with an ordinary pickle.
+PICKLE_OUT_OF_BAND_MAGIC = b"\xffPYXOOB\x01"
+
 def read_pickle(filepath, compression="auto"):
+    """
+    Args:
+        filepath (str): path/to/file
+        compression (str, optional): {None, gzip, bz2}. Defaults to "auto".
+            Files written with `write_pickle(..., out_of_band=True)` are detected automatically.
+    """
     with open_file_reader(filepath, compression=compression, binary=True) as f:
-        return pickle.load(f)
+        if f.read(len(PICKLE_OUT_OF_BAND_MAGIC)) != PICKLE_OUT_OF_BAND_MAGIC:
+            f.seek(0)
+            return pickle.load(f)
+
+        # Sizes of uncompressed files can be checked before allocating buffers
+        if isinstance(getattr(f, "raw", None), io.FileIO):
+            n_bytes_remaining = os.fstat(f.fileno()).st_size - f.tell()
+        else:
+            n_bytes_remaining = None
+
+        def read_size():
+            data = f.read(8)
+            if len(data) != 8:
+                raise EOFError(f"Truncated out-of-band pickle header in {filepath}")
+            (size,) = struct.unpack("<Q", data)
+            if (n_bytes_remaining is not None) and (size > n_bytes_remaining):
+                raise pickle.UnpicklingError(f"Out-of-band pickle header in {filepath} exceeds the file size")
+            return size
+
+        n_buffers = read_size()
+        buffers = list()
+        for _ in range(n_buffers):
+            nbytes = read_size()
+            buffer = bytearray(nbytes)
+            if f.readinto(buffer) != nbytes:
+                raise EOFError(f"Truncated out-of-band pickle buffer in {filepath}")
+            if n_bytes_remaining is not None:
+                n_bytes_remaining -= 8 + nbytes
+            buffers.append(buffer)
+        return pickle.load(f, buffers=buffers)
     
-def write_pickle(obj, filepath, compression="auto"):
+def write_pickle(obj, filepath, compression="auto", protocol=pickle.HIGHEST_PROTOCOL, out_of_band=False):
+    """
+    Args:
+        obj: Object to pickle
+        filepath (str): path/to/file
+        compression (str, optional): {None, gzip, bz2}. Defaults to "auto".
+        protocol (int, optional): Pickle protocol. Defaults to pickle.HIGHEST_PROTOCOL.
+        out_of_band (bool, optional): Whether to write large buffers (e.g., NumPy arrays) outside of the 
+            pickle stream to avoid copying them into it (requires protocol >= 5). The file starts with 
+            `PICKLE_OUT_OF_BAND_MAGIC` and can only be loaded with `read_pickle`. Defaults to False.
+    """
     with open_file_writer(filepath, compression=compression, binary=True) as f:
-        pickle.dump(obj, f)
+        if not out_of_band:
+            pickle.dump(obj, f, protocol=protocol)
+            return
+        buffers = list()
+        data = pickle.dumps(obj, protocol=protocol, buffer_callback=buffers.append)
+        f.write(PICKLE_OUT_OF_BAND_MAGIC)
+        f.write(struct.pack("<Q", len(buffers)))
+        for buffer in buffers:
+            view = buffer.raw()
+            f.write(struct.pack("<Q", view.nbytes))
+            f.write(view)
+        f.write(data)
         
 # Json I/O
-def read_json(filepath):
+def read_json(filepath, use_orjson=False):
+    # orjson is faster but opt-in because it parses integers outside of the 64-bit range as floats
+    if use_orjson and (orjson is not None):
+        with open_file_reader(filepath, compression=None, binary=True) as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError: # e.g., non-standard NaN/Infinity literals
+            return json.loads(data)
     with open_file_reader(filepath, compression=None, binary=False) as f:
         return json.load(f)
     
-def write_json(obj, filepath, indent=4):
+def write_json(obj, filepath, indent=None):
+    # orjson is not used here because its output differs from `json.dump` (NaN/Infinity as null, separators, non-ASCII, indentation)
     with open_file_writer(filepath, compression=None, binary=False) as f:
-        return json.dump(obj, f)
+        return json.dump(obj, f, indent=indent)
     
 # Archive
 # =======
@@ -267,10 +399,13 @@ def format_header(text, line_character="=", n=None):
     return "{}\n{}\n{}".format(line, text, line)
 
 # Format memory
+FORMAT_BYTES_UNITS = [("B", 1), ("KB", 1024), ("MB", 1024**2), ("GB", 1024**3), ("TB", 1024**4)]
+
 def format_bytes(B, unit="auto", return_units=True):
     """
     Return the given bytes as a human-readable string in KB, MB, GB, or TB.
     1 KB = 1024 Bytes
+    None (e.g., an unknown size) is returned as "unknown" (or None if `return_units=False`).
 
     Adapted from the following source (@whereisalext):
     https://stackoverflow.com/questions/12523586/python-format-size-application-converting-b-to-kb-mb-gb-tb/52379087
@@ -283,6 +418,9 @@ def format_bytes(B, unit="auto", return_units=True):
     def format_with_unit(size, unit_name):
         return f"{size:.2f} {unit_name}" if return_units else size
 
+    if B is None:
+        return "unknown" if return_units else None
+
     unit = unit.lower()
     if unit != "auto":
         unit = unit.lower()
@@ -299,19 +437,21 @@ def format_bytes(B, unit="auto", return_units=True):
         else:
             raise ValueError(f"Unknown unit: {unit}")
     else:
-        if B < KB:
-            return format_with_unit(B, "B")
-        elif KB <= B < MB:
-            return format_with_unit(B / KB, "KB")
-        elif MB <= B < GB:
-            return format_with_unit(B / MB, "MB")
-        elif GB <= B < TB:
-            return format_with_unit(B / GB, "GB")
+        # Each unit spans 10 bits so the bit length indexes the unit directly
+        if math.isfinite(B):
+            index = min((max(int(B), 1).bit_length() - 1) // 10, len(FORMAT_BYTES_UNITS) - 1)
         else:
-            return format_with_unit(B / TB, "TB")
+            index = 0 if B < 0 else len(FORMAT_BYTES_UNITS) - 1
+        unit_name, unit_size = FORMAT_BYTES_UNITS[index]
+        if index == 0:
+            return format_with_unit(B, unit_name)
+        return format_with_unit(B / unit_size, unit_name)
         
 # Logging
 # =======
+# Shared by all handlers created in `build_logger` and `reset_logger`
+LOGGING_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
 def build_logger(logger_name=__name__, stream=sys.stdout):
     """
     Build a logger object that outputs to a given stream.
@@ -326,14 +466,18 @@ def build_logger(logger_name=__name__, stream=sys.stdout):
     # Create a logger object
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.DEBUG)  # Set the logging level
+
+    # Don't add a duplicate handler if the logger already outputs to this stream
+    for handler in logger.handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream is stream:
+            return logger
     
     # Create a stream handler to output logs to stdout
     stream_handler = logging.StreamHandler(stream)
     stream_handler.setLevel(logging.DEBUG)  # Set the level for the handler
     
-    # Create a formatter and set it to the handler
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    stream_handler.setFormatter(formatter)
+    # Set the shared formatter to the handler
+    stream_handler.setFormatter(LOGGING_FORMATTER)
     
     # Add the handler to the logger
     logger.addHandler(stream_handler)
@@ -358,8 +502,7 @@ def reset_logger(logger):
     # Set a new handler (for example, to output to stdout)
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    stream_handler.setFormatter(formatter)
+    stream_handler.setFormatter(LOGGING_FORMATTER)
     logger.addHandler(stream_handler)
     
     # Optionally set a new level
@@ -377,10 +520,11 @@ def get_timestamp(format_string:str="%Y-%m-%d %H:%M:%S"):
     Returns:
         str: The timestamp string.
     """
-    # Get the current date and time
-    now =  datetime.now()
-    # Create a timestamp string
-    return now.strftime(format_string)
+    # Directives that `time.strftime` handles differently than a naive `datetime`
+    if ("%f" in format_string) or ("%z" in format_string) or ("%Z" in format_string):
+        return datetime.now().strftime(format_string)
+    # Create a timestamp string without constructing a datetime object
+    return time.strftime(format_string, time.localtime())
 
 # Check argument choices
 def check_argument_choice(query, choices:set):
@@ -398,15 +542,21 @@ def check_argument_choice(query, choices:set):
     query : str
         The argument choice to check
     choices : set
-        The set of allowed choices
+        The set of allowed choices (pass a set or frozenset to avoid converting on each call)
     """
-    choices = set(choices)
+    if not isinstance(choices, (set, frozenset)):
+        choices = frozenset(choices)
     if query not in choices:
-        raise ValueError(f"Invalid option '{query}'. Allowed choices are: {choices}")
+        raise ValueError(f"Invalid option '{query}'. Allowed choices are: {set(choices)}")
 
 # Profiling
 # =========
-def profile_peak_memory(func):
+PROFILE_PEAK_MEMORY_BACKENDS = frozenset(["tracemalloc", "sampling", "memray"])
+
+# Active tracemalloc measurements of nested `profile_peak_memory` calls (outermost first)
+_PROFILE_PEAK_MEMORY_FRAMES = list()
+
+def profile_peak_memory(func=None, backend="tracemalloc", sample_rate=131072):
     """
     Decorator to measure and log the peak memory usage of a function.
 
@@ -414,6 +564,13 @@ def profile_peak_memory(func):
     ----------
     func : callable
         The function to measure and log the peak memory usage of.
+    backend : str
+        The memory profiler to use {"tracemalloc", "sampling", "memray"}. [Default: "tracemalloc"]
+            * tracemalloc: Traces every Python allocation (standard library)
+            * sampling: Samples allocations every `sample_rate` bytes using `mprofile` (low overhead for long-running functions, reports an estimate)
+            * memray: Tracks allocations with `memray` (includes allocations made by C extensions)
+    sample_rate : int
+        Average number of bytes between sampled allocations when `backend="sampling"`. [Default: 131072 (128KB)]
 
     Returns
     -------
@@ -422,9 +579,22 @@ def profile_peak_memory(func):
 
     Notes
     -----
-    This decorator uses the `memory_usage` function from the `memory_profiler`
-    library to measure the memory usage of the decorated function. The peak
-    memory usage is then logged to the console.
+    This decorator uses `tracemalloc` to measure the peak memory allocated
+    by Python while the decorated function runs. The peak memory usage is 
+    then logged to the console.
+
+    Nested decorated functions each report their own peak and the peak of 
+    an inner call counts towards the enclosing call. If `tracemalloc` was 
+    already started outside of this decorator, its peak is not reset so the 
+    reported value is an upper bound (the peak since the session started 
+    or was last reset, relative to the memory traced when the function was called).
+
+    With `backend="sampling"` the peak is an estimate: the sampled peak is 
+    scaled by the sampling weights of the allocations still alive when the 
+    function returns (e.g., its return value), so it is most accurate when 
+    those are representative of the allocations at the peak. If nothing is 
+    alive on return the sampled peak is only scaled as a single allocation 
+    and is a lower bound.
 
     Example
     -------
@@ -434,12 +604,79 @@ def profile_peak_memory(func):
     ...     return
     >>> my_function()
     Peak memory usage for my_function: 123.45 MB
+
+    >>> @profile_peak_memory(backend="sampling")
+    ... def my_long_running_function():
+    ...     return
     """
+    check_argument_choice(backend, PROFILE_PEAK_MEMORY_BACKENDS)
+    if func is None:
+        return functools.partial(profile_peak_memory, backend=backend, sample_rate=sample_rate)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         # Measure memory usage
-        mem_usage = memory_usage((func, args, kwargs), max_usage=True, retval=True, max_iterations=1)
-        peak_memory, result = mem_usage[0], mem_usage[1]
+        if backend == "memray":
+            try:
+                import memray
+            except ImportError:
+                raise ImportError("backend='memray' requires the `memray` package: pip install memray")
+            with tempfile.TemporaryDirectory() as tmpdir:
+                capture_filepath = os.path.join(tmpdir, "memray.bin")
+                with memray.Tracker(capture_filepath, native_traces=False):
+                    result = func(*args, **kwargs)
+                peak_memory = memray.FileReader(capture_filepath).metadata.peak_memory
+
+        elif backend == "sampling":
+            try:
+                import mprofile
+            except ImportError:
+                raise ImportError("backend='sampling' requires the `mprofile` package: pip install mprofile")
+            if mprofile.is_tracing():
+                raise RuntimeError("backend='sampling' cannot be nested")
+            mprofile.start(sample_rate=sample_rate)
+            baseline_memory, _ = mprofile.get_traced_memory()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _, peak_memory = mprofile.get_traced_memory()
+                snapshot = mprofile.take_snapshot()
+                mprofile.stop()
+            peak_memory -= baseline_memory
+            # The traced values only count the sampled bytes so scale them by the weights mprofile gives the 
+            # sampled allocations still alive on return (or treat the peak as one allocation if none are)
+            sampled_memory = sum(trace.size for trace in snapshot.traces)
+            if sampled_memory > 0:
+                peak_memory *= sum(stat.size for stat in snapshot.statistics("filename")) / sampled_memory
+            elif peak_memory > 0:
+                peak_memory /= 1.0 - math.exp(-peak_memory / sample_rate)
+
+        else:
+            owns_session = not tracemalloc.is_tracing()
+            if owns_session:
+                tracemalloc.start()
+            # Only reset the peak of a session started by an enclosing `profile_peak_memory` call
+            frames = _PROFILE_PEAK_MEMORY_FRAMES
+            resets_peak = bool(frames) and frames[0]["owns_session"]
+            if resets_peak:
+                # Save the enclosing call's peak before resetting it for this call
+                frames[-1]["peak"] = max(frames[-1]["peak"], tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            baseline_memory, _ = tracemalloc.get_traced_memory()
+            frame = {"baseline":baseline_memory, "peak":baseline_memory, "owns_session":owns_session}
+            frames.append(frame)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                frames.pop()
+                peak_memory = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                # Pass the absolute peak up to the enclosing call
+                if frames:
+                    frames[-1]["peak"] = max(frames[-1]["peak"], peak_memory)
+                if owns_session:
+                    tracemalloc.stop()
+            peak_memory -= baseline_memory
+
         print(f"Peak memory usage for {func.__name__}: {format_bytes(peak_memory)}")
         return result
     return wrapper
@@ -582,41 +819,95 @@ def add_executables_to_environment(executable_names:list, environment:dict=os.en
             raise FileNotFoundError(msg)
             
 
+# Recursively list files
+def scandir_files(directory:str):
+    """
+    Recursively yield the files in a directory using `os.scandir`.
+
+    Like `os.walk`, symlinks to directories are not followed and unreadable 
+    directories are skipped. Unlike `os.walk`, the file type comes from the 
+    cached directory entry so no additional `stat` calls are needed.
+
+    Parameters:
+    - directory: The path to the directory.
+
+    Yields:
+    - os.DirEntry objects for each file (including symlinks to files).
+    """
+    try:
+        iterator = os.scandir(directory)
+    except OSError:
+        return
+    with iterator:
+        for entry in iterator:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    yield from scandir_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
 # md5 hash from file
-def get_md5hash_from_file(filepath:str, block_size=65536):
+def get_md5hash_from_file(filepath:str, block_size=1048576, algorithm="md5"):
     """
     Calculate the MD5 hash of a file.
 
     Parameters:
     - file_path: The path to the file.
-    - block_size: The size of each block read from the file (default is 64KB).
+    - block_size: The size of each block read from the file if it cannot be memory-mapped (default is 1MB).
+    - algorithm: Hash algorithm to use (default is md5). Accepts any name supported by `hashlib.new`
+      or "blake3" (requires the `blake3` package). For content addressing large files, "blake3"
+      (SIMD and multithreaded) or "blake2b" are much faster than md5.
 
     Returns:
-    - A string containing the MD5 hash.
+    - A string containing the hash.
     """
-    md5 = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        for block in iter(lambda: f.read(block_size), b''):
-            md5.update(block)
-    return md5.hexdigest()
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ImportError("algorithm='blake3' requires the `blake3` package: pip install blake3")
+        return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(filepath).hexdigest()
+
+    with open(filepath, 'rb', buffering=0) as f:
+        # Python >= 3.11 runs the read/update loop in C and releases the GIL
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, algorithm).hexdigest()
+
+        digest = hashlib.new(algorithm)
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+        except (ValueError, OSError): # Empty files and special files cannot be memory-mapped
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return digest.hexdigest()
 
 # md5 hash from directory
-def get_md5hash_from_directory(directory:str):
+def get_md5hash_from_directory(directory:str, n_jobs:int=None, algorithm="md5"):
     """
     Calculate the MD5 hash of all files in a directory.
 
     Parameters:
     - directory_path: The path to the directory.
+    - algorithm: Hash algorithm to use (default is md5). See `get_md5hash_from_file`.
+    - n_jobs: Number of threads used to hash files concurrently (default is os.cpu_count()).
+      hashlib releases the GIL while hashing so threads scale across cores.
 
     Returns:
     - A dictionary where the keys are file paths and the values are their MD5 hashes.
     """
+    filepaths = [entry.path for entry in scandir_files(directory)]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    hash_file = functools.partial(get_md5hash_from_file, algorithm=algorithm)
+
     md5_hashes = {}
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.path.isfile(file_path):
-                file_md5 = get_md5hash_from_file(file_path)
+    if n_jobs == 1:
+        for file_path in filepaths:
+            md5_hashes[file_path] = hash_file(file_path)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            for file_path, file_md5 in zip(filepaths, executor.map(hash_file, filepaths)):
                 md5_hashes[file_path] = file_md5
     return md5_hashes
 
@@ -642,35 +933,51 @@ def get_directory_size(directory:str='.'):
     """
 
     total_size = 0
-    seen = {}
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            try:
-                stat = os.stat(fp)
-            except OSError:
-                continue
+    seen = set()
+    for entry in scandir_files(directory):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
 
-            try:
-                seen[stat.st_ino]
-            except KeyError:
-                seen[stat.st_ino] = True
-            else:
-                continue
+        # Count hard links once
+        if stat.st_ino in seen:
+            continue
+        seen.add(stat.st_ino)
 
-            total_size += stat.st_size
+        total_size += stat.st_size
 
     return total_size
 
 
 # Classes
 # =======
+# Characters and builtins that require `RunShellCommand` to run through a shell
+SHELL_METACHARACTERS = frozenset(";|&$`<>*?()[]{}~!#\n\\")
+SHELL_BUILTINS = frozenset([
+    ".", "alias", "bg", "break", "case", "cd", "command", "continue", "declare", "eval", "exec", "exit", "export", 
+    "fg", "for", "function", "if", "jobs", "local", "read", "return", "select", "set", "shopt", "source", "time", 
+    "trap", "type", "ulimit", "umask", "unalias", "unset", "until", "wait", "while",
+    ])
+
 class RunShellCommand(object):
     """
     Args: 
         command:str command to be executed
         name:str name associated with command [Default: None]
         shell_executable:str path to executable [Default: /bin/bash]
+        use_shell:bool run the command through `shell_executable`.  If None, the shell is only used when the
+            command contains shell syntax (e.g., pipes, redirects, globs, variables) or shell builtins. 
+            Otherwise, the command is tokenized with `shlex` and executed directly. [Default: None]
+
+    Peak memory:
+        `peak_memory_` is the largest peak resident set size (in bytes) of the command or any of its descendants
+        (`ru_maxrss` from `os.wait4`).  On Linux, a child's `ru_maxrss` starts from the peak inherited from this 
+        Python process so a command that uses less memory than that reports the inherited peak instead. In that 
+        case `peak_memory_` is an upper bound and `peak_memory_upper_bound_` is True.  When stdout/stderr are piped, 
+        the process is reaped by `communicate` and `peak_memory_` is the largest peak of all child processes waited 
+        for so far (`RUSAGE_CHILDREN`), which is an upper bound if it doesn't exceed earlier peaks.  Without the 
+        `resource` module (e.g., Windows), `peak_memory_` is None.
         
     Usage: 
         cmd = RunShellCommand("time (sleep 5 & echo 'Hello World')", name="Demo")
@@ -697,6 +1004,7 @@ class RunShellCommand(object):
         shell_executable:str="/bin/bash",
         validate_input_filepaths:list=None,
         validate_output_filepaths:list=None,
+        use_shell:bool=None,
         ):
 
         if isinstance(command, str):
@@ -705,25 +1013,116 @@ class RunShellCommand(object):
         self.command = command
         self.name = name
         self.shell_executable = shell_executable
+        self.use_shell = use_shell
         self.validate_input_filepaths = validate_input_filepaths if validate_input_filepaths else list()
         self.validate_output_filepaths = validate_input_filepaths if validate_input_filepaths else list()
         self.executed = False
+        self.spooled_filepaths_ = list()
+
+    @staticmethod
+    def requires_shell(command:str, env:dict=None, cwd:str=None):
+        """
+        Check whether a command needs a shell to run or can be executed directly.
+
+        Parameters
+        ----------
+        command : str
+            The command to check.
+        env : dict
+            Environment the command will run in. Its PATH is used to find the executable. [Default: `os.environ`]
+        cwd : str
+            Working directory the command will run in. Relative executable paths are resolved against it. [Default: None]
+
+        Returns
+        -------
+        bool
+            True if the command contains shell syntax, starts with a shell builtin/keyword, 
+            or its executable cannot be found in the PATH.
+        """
+        if any(character in SHELL_METACHARACTERS for character in command):
+            return True
+        try:
+            argv = shlex.split(command)
+        except ValueError: # Unbalanced quotes
+            return True
+        if not argv:
+            return True
+        executable = argv[0]
+        if ("=" in executable) or (executable in SHELL_BUILTINS):
+            return True
+        # Resolve the executable the same way `subprocess.Popen` would
+        if os.sep in executable:
+            if (cwd is not None) and (not os.path.isabs(executable)):
+                executable = os.path.join(cwd, executable)
+            return not (os.path.isfile(executable) and os.access(executable, os.X_OK))
+        return shutil.which(executable, path=os.pathsep.join(os.get_exec_path(env))) is None
         
-    def run(self, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kws):
+    def run(self, stdout=subprocess.PIPE, stderr=subprocess.PIPE, spool_max_size=16777216, **popen_kws):
+        """
+        Args:
+            stdout: subprocess.PIPE, None, filepath, or file object [Default: subprocess.PIPE]
+            stderr: subprocess.PIPE, None, filepath, or file object [Default: subprocess.PIPE]
+            spool_max_size:int Captured (i.e., subprocess.PIPE) output is streamed to a temporary file.
+                If the output is larger than this many bytes, it is left on disk, `stdout_`/`stderr_` are set
+                to None and the temporary filepath is stored in `redirect_stdout`/`redirect_stderr` and `spooled_filepaths_`. 
+                These files belong to this object: remove them with `remove_spooled_output` (also called when the 
+                command is run again). [Default: 16777216 (16MB)]
+            **popen_kws: Additional arguments passed to `subprocess.Popen`
+        """
+        # Remove output spooled to disk by a previous run
+        self.remove_spooled_output()
+
+        # Avoid spawning an intermediate shell when the command doesn't need one
+        self.use_shell_ = self.use_shell
+        if self.use_shell_ is None:
+            self.use_shell_ = self.requires_shell(self.command, env=popen_kws.get("env"), cwd=popen_kws.get("cwd"))
+        if self.use_shell_:
+            args = self.command
+            shell_kws = dict(shell=True, executable=self.shell_executable)
+        else:
+            args = shlex.split(self.command)
+            shell_kws = dict(shell=False)
+
+        # Peak memory (ru_maxrss is in bytes on macOS and kilobytes elsewhere)
+        rusage_scale = 1 if sys.platform == "darwin" else 1024
+
         def execute_command(stdout, stderr):
+            # Peak memory before the command is spawned
+            if resource is not None:
+                inherited_peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rusage_scale
+                children_peak_memory = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rusage_scale
+
             # Execute the process
             self.process_ = subprocess.Popen(
-                self.command,
-                shell=True,
+                args,
                 stdout=stdout,
                 stderr=stderr,
-                executable=self.shell_executable,
                 universal_newlines=True,  # or text=True
-                bufsize=1,  # Line-buffered mode
+                bufsize=-1,  # Fully buffered mode
+                **shell_kws,
                 **popen_kws,
             )
-            # Wait until process is complete and return stdout/stderr
-            self.stdout_, self.stderr_ = self.process_.communicate()
+            if resource is None:
+                # Resource usage is unavailable (e.g., Windows)
+                self.stdout_, self.stderr_ = self.process_.communicate()
+                self.peak_memory_ = None
+                self.peak_memory_upper_bound_ = False
+            elif (self.process_.stdin is None) and (self.process_.stdout is None) and (self.process_.stderr is None):
+                # Reap the process directly to get the resource usage of this command (and its descendants) only
+                _, status, rusage = os.wait4(self.process_.pid, 0)
+                self.process_.returncode = os.waitstatus_to_exitcode(status)
+                self.stdout_, self.stderr_ = None, None
+                self.peak_memory_ = rusage.ru_maxrss * rusage_scale
+            else:
+                # Wait until process is complete and return stdout/stderr
+                self.stdout_, self.stderr_ = self.process_.communicate()
+                # Pipes require `communicate` so use the peak of all waited-for child processes
+                self.peak_memory_ = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rusage_scale
+                inherited_peak_memory = max(inherited_peak_memory, children_peak_memory)
+
+            # ru_maxrss starts from the peak inherited from this process (or earlier children when piped)
+            if resource is not None:
+                self.peak_memory_upper_bound_ = self.peak_memory_ <= inherited_peak_memory
 
             # Flush the buffers
             if stdout is not None and hasattr(stdout, "flush"):
@@ -741,6 +1140,12 @@ class RunShellCommand(object):
             #     if self.stderr_:
             #         self.stderr_ = self.stderr_.decode(encoding)
 
+        # Validate input files before creating any output files
+        t0 = time.time()
+        if self.validate_input_filepaths:
+            for filepath in self.validate_input_filepaths:
+                check_file(filepath, empty_ok=False)
+
         # I/O
         self.redirect_stdout = None
         if isinstance(stdout, str):
@@ -752,12 +1157,37 @@ class RunShellCommand(object):
             self.redirect_stderr = stderr
             stderr = open(stderr, "w")
 
-        # Measure memory usage
-        t0 = time.time()
-        if self.validate_input_filepaths:
-            for filepath in self.validate_input_filepaths:
-                check_file(filepath, empty_ok=False)
-        self.memory_usage_ = memory_usage((execute_command, (stdout, stderr,)), max_iterations=1)
+        # Stream captured output to disk instead of buffering it in memory
+        spool_stdout = None
+        if stdout is subprocess.PIPE:
+            spool_stdout = stdout = tempfile.NamedTemporaryFile(mode="w+", prefix="pyexeggutor_", suffix=".o", delete=False)
+
+        spool_stderr = None
+        if stderr is subprocess.PIPE:
+            spool_stderr = stderr = tempfile.NamedTemporaryFile(mode="w+", prefix="pyexeggutor_", suffix=".e", delete=False)
+
+        def load_spooled_output(filepath):
+            if os.path.getsize(filepath) > spool_max_size:
+                return None
+            with open(filepath, "r") as f:
+                output = f.read()
+            os.remove(filepath)
+            return output
+
+        # Execute command
+        try:
+            execute_command(stdout, stderr)
+        except BaseException:
+            # Don't leave open redirect files or spool files behind if the command could not be executed
+            if self.redirect_stdout:
+                stdout.close()
+            if self.redirect_stderr:
+                stderr.close()
+            for spool in (spool_stdout, spool_stderr):
+                if spool is not None:
+                    spool.close()
+                    os.remove(spool.name)
+            raise
         self.duration_ = time.time() - t0
 
         # Flush
@@ -772,7 +1202,18 @@ class RunShellCommand(object):
         if hasattr(stderr, "close"):
             stderr.close()
 
-        self.peak_memory_ = max(self.memory_usage_)
+        # Load spooled output unless it's too large to keep in memory
+        if spool_stdout is not None:
+            self.stdout_ = load_spooled_output(spool_stdout.name)
+            if self.stdout_ is None:
+                self.redirect_stdout = spool_stdout.name
+                self.spooled_filepaths_.append(spool_stdout.name)
+        if spool_stderr is not None:
+            self.stderr_ = load_spooled_output(spool_stderr.name)
+            if self.stderr_ is None:
+                self.redirect_stderr = spool_stderr.name
+                self.spooled_filepaths_.append(spool_stderr.name)
+
         self.executed = True
 
         return self
@@ -780,7 +1221,10 @@ class RunShellCommand(object):
 
     def __repr__(self):
         name_text = "{}(name:{})".format(self.__class__.__name__, self.name)
-        command_text = "({})$ {}".format(self.shell_executable, self.command)
+        if getattr(self, "use_shell_", True):
+            command_text = "({})$ {}".format(self.shell_executable, self.command)
+        else:
+            command_text = "(no shell)$ {}".format(self.command)
         n = max(len(name_text), len(command_text))
         pad = 4
         fields = [
@@ -818,7 +1262,7 @@ class RunShellCommand(object):
 
             fields += [
             pad*" " + "- returncode: {}".format(self.returncode_),
-            pad*" " + "- peak memory: {}".format(format_bytes(self.peak_memory_)),
+            pad*" " + "- peak memory: {}{}".format(format_bytes(self.peak_memory_), " (upper bound)" if self.peak_memory_upper_bound_ else ""),
             pad*" " + "- duration: {}".format(format_duration(self.duration_)),
             ]
         return "\n".join(fields)
@@ -827,23 +1271,53 @@ class RunShellCommand(object):
     def dump(self, output_directory:str):    
         # stdout
         with open_file_writer(os.path.join(output_directory, f"{self.name}.o")) as f:
-            print(self.stdout_, file=f)
+            if (self.stdout_ is None) and (self.redirect_stdout in self.spooled_filepaths_):
+                # Copy output spilled to disk (with the trailing newline `print` adds)
+                with open(self.redirect_stdout, "r") as f_redirect:
+                    shutil.copyfileobj(f_redirect, f)
+                f.write("\n")
+            else:
+                print(self.stdout_, file=f)
         # stderr
         with open_file_writer(os.path.join(output_directory, f"{self.name}.e")) as f:
-            print(self.stderr_, file=f)
+            if (self.stderr_ is None) and (self.redirect_stderr in self.spooled_filepaths_):
+                # Copy output spilled to disk (with the trailing newline `print` adds)
+                with open(self.redirect_stderr, "r") as f_redirect:
+                    shutil.copyfileobj(f_redirect, f)
+                f.write("\n")
+            else:
+                print(self.stderr_, file=f)
         # returncode
         with open_file_writer(os.path.join(output_directory, f"{self.name}.returncode")) as f:
             print(self.returncode_, file=f)
             
+    # Remove output spooled to disk
+    def remove_spooled_output(self):
+        """
+        Remove the temporary files holding output larger than `spool_max_size` from the last run.
+        """
+        for filepath in self.spooled_filepaths_:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            if self.redirect_stdout == filepath:
+                self.redirect_stdout = None
+            if self.redirect_stderr == filepath:
+                self.redirect_stderr = None
+        self.spooled_filepaths_ = list()
+
     # Check status
     def check_status(self):
         if self.returncode_ != 0:
+            if (self.stderr_ is None) and self.redirect_stderr:
+                stderr_text = f"stderr: {self.redirect_stderr}"
+            else:
+                stderr_text = f"stderr:\n{self.stderr_}"
             raise subprocess.CalledProcessError(
                 returncode=self.returncode_,
                 cmd="\n".join([
                 f"Command Failed: {self.command}",
                 f"return code: {self.returncode_}",
-                f"stderr:\n{self.stderr_}",
+                stderr_text,
                 ]),
             )
         else:
@@ -868,10 +1342,11 @@ class DisplayablePath(object):
     display_parent_prefix_middle = '    '
     display_parent_prefix_last = '|   '
 
-    def __init__(self, path, parent_path, is_last):
-        self.path = pathlib.Path(str(path))
+    def __init__(self, path, parent_path, is_last, is_dir=None):
+        self.path = path if isinstance(path, pathlib.Path) else pathlib.Path(path)
         self.parent = parent_path
         self.is_last = is_last
+        self.is_dir = self.path.is_dir() if is_dir is None else is_dir
         if self.parent:
             self.depth = self.parent.depth + 1
         else:
@@ -879,42 +1354,40 @@ class DisplayablePath(object):
 
     @property
     def displayname(self):
-        if self.path.is_dir():
+        if self.is_dir:
             return self.path.name + '/'
         return self.path.name
 
     @classmethod
     def make_tree(cls, root, parent=None, is_last=False, criteria=None):
-        root = pathlib.Path(str(root))
         criteria = criteria or cls._default_criteria
 
-        displayable_root = cls(root, parent, is_last)
-        yield displayable_root
-
-        children = sorted(list(path
-                               for path in root.iterdir()
-                               if criteria(path)),
-                          key=lambda s: str(s).lower())
-        count = 1
-        for path in children:
-            is_last = count == len(children)
-            if path.is_dir():
-                for item in cls.make_tree(path, parent=displayable_root, is_last=is_last, criteria=criteria):
-                    yield item
-            else:
-                yield cls(path, displayable_root, is_last)
-            count += 1
+        # Depth-first traversal with an explicit stack of (path, is_dir, parent, is_last)
+        stack = [(pathlib.Path(root), None, parent, is_last)]
+        while stack:
+            path, is_dir, parent, is_last = stack.pop()
+            displayable_path = cls(path, parent, is_last, is_dir=is_dir)
+            yield displayable_path
+
+            if displayable_path.is_dir:
+                children = list()
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        child_path = pathlib.Path(entry.path)
+                        if criteria(child_path):
+                            children.append((entry.path.lower(), child_path, entry.is_dir()))
+                children.sort(key=lambda child: child[0])
+
+                # Push in reverse so children are yielded in sorted order
+                n = len(children)
+                for i in range(n - 1, -1, -1):
+                    _, child_path, child_is_dir = children[i]
+                    stack.append((child_path, child_is_dir, displayable_path, i == n - 1))
 
     @classmethod
     def _default_criteria(cls, path):
         return True
 
-    @property
-    def displayname(self):
-        if self.path.is_dir():
-            return self.path.name + '/'
-        return self.path.name
-
     def displayable(self):
         if self.parent is None:
             return self.displayname
@@ -948,6 +1421,12 @@ class DisplayablePath(object):
         print(cls.get_ascii(root), file=file)
         
 # Genomics
+# Minimum sequence length for `fasta_writer` to wrap lines with NumPy (if installed)
+FASTA_NUMPY_MINIMUM_LENGTH = 1048576
+# Maximum line width for `fasta_writer` to wrap lines with NumPy. Wider lines are faster to join as 
+# slices since there are fewer of them (the NumPy path breaks even at ~180 characters per line)
+FASTA_NUMPY_MAXIMUM_WRAP = 160
+
 def fasta_writer(header:str, seq:str, file:TextIO, wrap:int=1000):
     """
     Write a FASTA record to a file
@@ -961,17 +1440,32 @@ def fasta_writer(header:str, seq:str, file:TextIO, wrap:int=1000):
     file : TextIO
         File to write the FASTA record to
     wrap : int, optional
-        Wrap the sequence at this many characters, by default 1000
+        Wrap the sequence at this many characters, by default 1000.
+        Sequences longer than `FASTA_NUMPY_MINIMUM_LENGTH` are wrapped with NumPy if installed and 
+        `wrap` is at most `FASTA_NUMPY_MAXIMUM_WRAP`.
     """
     # Write the FASTA header
-    print(f">{header}", file=file)
+    file.write(f">{header}\n")
     
-    if wrap:
-        # Write the sequence with lines of length 'wrap'
-        for i in range(0, len(seq), wrap):
-            # Get a chunk of the sequence with a max length of 'wrap'
-            line = seq[i:i+wrap]
-            print(line, file=file)
+    if wrap and (wrap <= FASTA_NUMPY_MAXIMUM_WRAP) and (np is not None) and (len(seq) >= FASTA_NUMPY_MINIMUM_LENGTH) and seq.isascii():
+        # Insert the newlines into a (lines, wrap + 1) byte array view instead of slicing in Python
+        buffer = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+        n_full_lines = buffer.size // wrap
+        lines = np.empty((n_full_lines, wrap + 1), dtype=np.uint8)
+        lines[:, :wrap] = buffer[:n_full_lines*wrap].reshape(n_full_lines, wrap)
+        lines[:, wrap] = ord("\n")
+        file.write(lines.tobytes().decode("ascii"))
+        remainder = seq[n_full_lines*wrap:]
+        if remainder:
+            file.write(remainder)
+            file.write("\n")
+    elif wrap:
+        # Write the sequence with lines of length 'wrap' in a single call
+        lines = [seq[i:i+wrap] for i in range(0, len(seq), wrap)]
+        if lines:
+            file.write("\n".join(lines))
+            file.write("\n")
     else:
-        print(seq, file=file)
+        file.write(seq)
+        file.write("\n")
         